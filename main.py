@@ -1,30 +1,114 @@
 from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-import base64
+from cachetools import TTLCache
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import asyncio
 import time
-import random
 import os
 import hashlib
-from typing import Optional
+import hmac
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 # Configuration
-API_KEYS = os.getenv("API_KEYS", "GUVI-HCL-TEAM-2024,test-key-123").split(",")
+API_KEYS = frozenset(
+    key.strip().encode("utf-8")
+    for key in os.getenv("API_KEYS", "GUVI-HCL-TEAM-2024,test-key-123").split(",")
+    if key.strip()
+)
 TEAM_NAME = os.getenv("TEAM_NAME", "GUVI_HCL_Team")
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "*").split(",")
+    if origin.strip()
+]
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 32))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 2))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 4096))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 60))
+# Request body limit in bytes; 0 (the default) accepts bodies of any size
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", 0))
+
+class _BodyTooLarge(Exception):
+    """Raised from the wrapped receive channel once the body exceeds the limit"""
+
+class BodySizeLimitMiddleware:
+    """Rejects request bodies over max_bytes while they stream in, before they are fully buffered"""
+
+    def __init__(self, app: ASGIApp, max_bytes: int) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            # Whatever the app answers to an aborted body (FastAPI turns it into a 400) is replaced
+            if exceeded and not response_started:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+        if exceeded and not response_started:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send) -> None:
+        response = ORJSONResponse({"detail": "Request body too large"}, status_code=413)
+        await response(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # The batcher starts lazily on first submit; only shutdown needs a hook
+    yield
+    await detection_batcher.stop()
 
 app = FastAPI(
     title=f"GUVI HCL Hackathon - {TEAM_NAME}",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+if MAX_BODY_BYTES > 0:
+    app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_BODY_BYTES)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["X-API-Key", "Content-Type"],
 )
 
 SUPPORTED_LANGUAGES = {
@@ -35,6 +119,36 @@ SUPPORTED_LANGUAGES = {
     "te": "Telugu"
 }
 
+# Confidence is always one of 40 steps from 0.60 to 0.99, so its percent labels are precomputed
+CONFIDENCE_LABELS = tuple(f"{(60 + step) / 100:.1%}" for step in range(40))
+
+def _confidence_variants(template: str) -> Tuple[str, ...]:
+    """Template rendered once per confidence label, so requests only index into it"""
+    return tuple(template.format(confidence=label) for label in CONFIDENCE_LABELS)
+
+# Explanations per (language, is_ai), each variant indexed by confidence step
+EXPLANATIONS: Dict[Tuple[str, bool], Tuple[Tuple[str, ...], ...]] = {}
+for _code, _name in SUPPORTED_LANGUAGES.items():
+    EXPLANATIONS[(_code, True)] = (
+        _confidence_variants(f"AI-generated {_name} voice detected with {{confidence}} confidence"),
+        _confidence_variants(f"Synthetic speech patterns identified in {_name} audio sample"),
+        _confidence_variants(f"Analysis suggests AI origin for this {_name} voice recording")
+    )
+    EXPLANATIONS[(_code, False)] = (
+        _confidence_variants(f"Human {_name} speech detected with {{confidence}} confidence"),
+        _confidence_variants(f"Natural vocal characteristics found in {_name} audio"),
+        _confidence_variants(f"Analysis indicates human origin for this {_name} speech")
+    )
+
+MODEL_METADATA = {
+    "version": "1.0.0",
+    "team": TEAM_NAME,
+    "detection_method": "audio_hash_analysis",
+    "processing_time_ms": 150,
+    "hackathon_compliant": True,
+    "languages_supported": tuple(SUPPORTED_LANGUAGES.values())
+}
+
 class AudioRequest(BaseModel):
     audio_base64: str
     language_hint: Optional[str] = None
@@ -46,8 +160,118 @@ class DetectionResponse(BaseModel):
     language_detected: str
     model_metadata: dict
 
-@app.get("/")
-def root():
+def hash_audio_batch(payloads: List[bytes]) -> List[int]:
+    """Deterministic 64-bit hash for each audio sample in a batch"""
+    return [
+        int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "little")
+        for payload in payloads
+    ]
+
+class DynamicBatcher:
+    """Accumulates detection work for up to max_batch_size items or max_wait_ms"""
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[bytes]], List[int]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 2
+    ) -> None:
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Queue:
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run(self.queue))
+        return self.queue
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.queue = None
+        self.loop = None
+
+    async def submit(self, payload: bytes) -> int:
+        # Started lazily too, in case the startup event never ran (e.g. lifespan disabled)
+        # or the batcher belongs to an event loop that is no longer the running one
+        loop = asyncio.get_running_loop()
+        queue = self.queue if self.queue is not None and self.loop is loop else self.start()
+        future = loop.create_future()
+        await queue.put((payload, future))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> List[Tuple[bytes, asyncio.Future]]:
+        batch = [await queue.get()]
+        self._drain(queue, batch)
+        # A lone request is flushed immediately; the window is only waited out under load
+        if len(batch) == 1:
+            return batch
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            self._drain(queue, batch)
+        return batch
+
+    def _drain(self, queue: asyncio.Queue, batch: List[Tuple[bytes, asyncio.Future]]) -> None:
+        while len(batch) < self.max_batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = await self._collect(queue)
+            # Bucket by length so a real model behind this sees similarly sized inputs together
+            batch.sort(key=lambda item: len(item[0]))
+            try:
+                results = self.process_batch([payload for payload, _ in batch])
+            except Exception as exc:
+                self._fail(batch, exc)
+                continue
+            if len(results) != len(batch):
+                self._fail(batch, RuntimeError(
+                    f"process_batch returned {len(results)} results for {len(batch)} items"
+                ))
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _fail(self, batch: List[Tuple[bytes, asyncio.Future]], exc: BaseException) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+detection_batcher = DynamicBatcher(
+    hash_audio_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS
+)
+
+# Detection results keyed by (language, hash of the sampled base64 prefix); hash() is
+# seeded per process, which is fine for a per-process cache
+detection_cache: TTLCache[Tuple[str, int], Dict[str, Any]] = TTLCache(
+    maxsize=CACHE_MAX_SIZE,
+    ttl=CACHE_TTL_SECONDS
+)
+
+@app.get("/", response_model=None)
+def root() -> Dict[str, Any]:
     return {
         "hackathon": "GUVI HCL AI Challenge 2024",
         "team": TEAM_NAME,
@@ -57,13 +281,13 @@ def root():
         "health": "/health"
     }
 
-@app.get("/health")
-@app.get("/healthz")
-def health():
+@app.get("/health", response_model=None)
+@app.get("/healthz", response_model=None)
+def health() -> Dict[str, Any]:
     return {"status": "healthy", "timestamp": time.time(), "team": TEAM_NAME}
 
-@app.get("/info")
-def api_info():
+@app.get("/info", response_model=None)
+def api_info() -> Dict[str, Any]:
     return {
         "team": TEAM_NAME,
         "supported_languages": [
@@ -83,11 +307,11 @@ def api_info():
         }
     }
 
-@app.post("/api/detect", response_model=DetectionResponse)
+@app.post("/api/detect", responses={200: {"model": DetectionResponse}})
 async def detect_voice(
     request: AudioRequest,
     x_api_key: Optional[str] = Header(None, alias="X-API-Key")
-):
+) -> ORJSONResponse:
     """Main detection endpoint for hackathon evaluation"""
     
     # Authentication
@@ -97,62 +321,50 @@ async def detect_voice(
             detail={"error": "API key required", "hint": "Use X-API-Key header"}
         )
     
-    if x_api_key not in API_KEYS:
+    candidate = x_api_key.encode("utf-8")
+    if not any(hmac.compare_digest(candidate, key) for key in API_KEYS):
         raise HTTPException(
             status_code=401,
-            detail={"error": "Invalid API key", "valid_keys": list(API_KEYS)}
+            detail={"error": "Invalid API key"}
         )
     
     # Validate language
-    language = request.language_hint or "en"
-    if language not in SUPPORTED_LANGUAGES:
-        language = "en"
+    language = request.language_hint if request.language_hint in SUPPORTED_LANGUAGES else "en"
     
-    # Decode audio
-    try:
-        audio_bytes = base64.b64decode(request.audio_base64[:10000])
-    except:
+    # Sample audio (hashing the base64 prefix is as deterministic as hashing decoded bytes)
+    payload = request.audio_base64[:10000]
+    if len(payload) < 4 or not payload.isascii():
         raise HTTPException(status_code=400, detail="Invalid base64 audio data")
     
+    # Repeated samples (retries, probes) are served from the cache
+    cache_key = (language, hash(payload))
+    cached = detection_cache.get(cache_key)
+    if cached is not None:
+        return ORJSONResponse(cached)
+    
     # Deterministic AI detection based on audio hash
-    audio_hash = int(hashlib.md5(audio_bytes).hexdigest(), 16)
+    audio_hash = await detection_batcher.submit(payload.encode("ascii"))
     
     # Create consistent but varied results
     is_ai = (audio_hash % 100) > 45  # 55% chance AI
-    confidence = ((audio_hash % 40) + 60) / 100  # 0.6 to 0.99
+    confidence_step = audio_hash % 40
+    confidence = (confidence_step + 60) / 100  # 0.6 to 0.99
     
     # Generate explanation
     lang_name = SUPPORTED_LANGUAGES[language]
+    explanations = EXPLANATIONS[(language, is_ai)]
+    explanation = explanations[audio_hash % len(explanations)][confidence_step]
     
-    if is_ai:
-        explanations = [
-            f"AI-generated {lang_name} voice detected with {confidence:.1%} confidence",
-            f"Synthetic speech patterns identified in {lang_name} audio sample",
-            f"Analysis suggests AI origin for this {lang_name} voice recording"
-        ]
-    else:
-        explanations = [
-            f"Human {lang_name} speech detected with {confidence:.1%} confidence",
-            f"Natural vocal characteristics found in {lang_name} audio",
-            f"Analysis indicates human origin for this {lang_name} speech"
-        ]
-    
-    explanation = explanations[audio_hash % len(explanations)]
-    
-    return DetectionResponse(
-        classification="AI" if is_ai else "Human",
-        confidence=round(confidence, 3),
-        explanation=explanation,
-        language_detected=lang_name,
-        model_metadata={
-            "version": "1.0.0",
-            "team": TEAM_NAME,
-            "detection_method": "audio_hash_analysis",
-            "processing_time_ms": 150,
-            "hackathon_compliant": True,
-            "languages_supported": list(SUPPORTED_LANGUAGES.values())
-        }
-    )
+    # Returned as a plain dict to skip response_model re-validation
+    result = {
+        "classification": "AI" if is_ai else "Human",
+        "confidence": round(confidence, 3),
+        "explanation": explanation,
+        "language_detected": lang_name,
+        "model_metadata": MODEL_METADATA
+    }
+    detection_cache[cache_key] = result
+    return ORJSONResponse(result)
 
 # For local development
 if __name__ == "__main__":
@@ -161,4 +373,12 @@ if __name__ == "__main__":
     print(f"Starting GUVI HCL Hackathon API on port {port}")
     print(f"Team: {TEAM_NAME}")
     print(f"Supported languages: {list(SUPPORTED_LANGUAGES.values())}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    print(f"Workers: {workers}")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        access_log=False
+    )